@@ -0,0 +1,92 @@
+"""
+Copyright (c) 2017 Nordic Semiconductor ASA
+
+Optional Numba-accelerated CoAP option header parser.
+
+When numba and numpy are installed, the option header scan (delta and
+length decoding, option numbers, value offsets) is compiled to native
+code and exposed as parse_options(). Without them, parse_options is
+None and piccata.option falls back to its pure Python parser. Neither
+package is a hard dependency of piccata.
+"""
+
+try:
+    import numpy
+    from numba import njit
+except ImportError:
+    numpy = None
+    njit = None
+
+
+def _parse_option_headers(buf, offset, end, numbers, starts, lengths):
+    """Scan option headers in buf[offset:end].
+
+    Fills the preallocated numbers/starts/lengths arrays with one entry
+    per option and returns (option count, payload offset). Written in
+    the numba nopython subset.
+    """
+    i = offset
+    count = 0
+    option_number = 0
+    while i < end:
+        dllen = buf[i]
+        if dllen == 0xFF:
+            return count, i + 1
+        delta = (dllen & 0xF0) >> 4
+        length = dllen & 0x0F
+        i += 1
+        if delta == 13:
+            if i >= end:
+                raise ValueError("Option header is truncated.")
+            delta = buf[i] + 13
+            i += 1
+        elif delta == 14:
+            if i + 1 >= end:
+                raise ValueError("Option header is truncated.")
+            delta = ((buf[i] << 8) | buf[i + 1]) + 269
+            i += 2
+        elif delta == 15:
+            raise ValueError("Value out of range.")
+        if length == 13:
+            if i >= end:
+                raise ValueError("Option header is truncated.")
+            length = buf[i] + 13
+            i += 1
+        elif length == 14:
+            if i + 1 >= end:
+                raise ValueError("Option header is truncated.")
+            length = ((buf[i] << 8) | buf[i + 1]) + 269
+            i += 2
+        elif length == 15:
+            raise ValueError("Value out of range.")
+        if i + length > end:
+            raise ValueError("Option value is truncated.")
+        option_number += delta
+        numbers[count] = option_number
+        starts[count] = i
+        lengths[count] = length
+        count += 1
+        i += length
+    return count, end
+
+
+if njit is not None:
+    _parse_option_headers = njit(cache=True)(_parse_option_headers)
+
+    def parse_options(buf, offset=0):
+        """Parse option headers from raw binary data with the compiled scanner.
+
+        Returns (numbers, starts, lengths, count, payload_offset) where the
+        first three are int32 arrays holding one entry per option.
+        """
+        data = numpy.frombuffer(bytes(buf), dtype=numpy.uint8)
+        end = len(data)
+        # Each option occupies at least one byte, so this bounds the count.
+        max_options = max(end - offset, 1)
+        numbers = numpy.empty(max_options, dtype=numpy.int32)
+        starts = numpy.empty(max_options, dtype=numpy.int32)
+        lengths = numpy.empty(max_options, dtype=numpy.int32)
+        count, payload_offset = _parse_option_headers(data, offset, end, numbers, starts, lengths)
+        return numbers, starts, lengths, count, int(payload_offset)
+else:
+    parse_options = None
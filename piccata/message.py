@@ -34,13 +34,14 @@ class Message(object):
         """Create Message object from binary representation of message."""
         (vttkl, code, mid) = struct.unpack('!BBH', rawdata[:4])
         version = (vttkl & 0xC0) >> 6
-        if version is not 1:
+        if version != 1:
             raise ValueError("Fatal Error: Protocol Version must be 1")
         mtype = (vttkl & 0x30) >> 4
         token_length = (vttkl & 0x0F)
         msg = Message(mtype=mtype, mid=mid, code=code)
         msg.token = rawdata[4:4 + token_length]
-        msg.payload = msg.opt.decode(rawdata[4 + token_length:])
+        payload_offset = msg.opt.decode(rawdata, 4 + token_length)
+        msg.payload = rawdata[payload_offset:]
         msg.remote = remote
         return msg
 
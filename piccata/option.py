@@ -6,66 +6,261 @@ CoAP option processing.
 """
 import collections
 import struct
-from itertools import chain
-from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
 
 from piccata.constants import *
+from piccata._option_jit import parse_options
+
+_ext_field_table = ((0, 0),) * 13 + ((1, 13), (2, 269), (None, None))
+"""Maps an option delta/length nibble to (number of extension bytes, bias).
+Nibble 15 is reserved and maps to (None, None)."""
+
+_compiled_encoders = {}
+"""Cache of encoders generated by Options.compile_encoder, keyed by the
+sorted tuple of option numbers."""
 
 class Options(object):
-    """Represent CoAP Header Options."""
+    """Represent CoAP Header Options.
 
-    def __init__(self):
-        self._options = {}
+    Options are stored as a flat list kept sorted by option number,
+    which is what encoding needs; CoAP messages carry few options, so
+    bisection beats a dict here. A parallel list of plain ints mirrors
+    the option numbers so lookups bisect over ints instead of probing
+    option attributes.
+    """
 
-    def decode(self, rawdata):
-        """Decode all options in message from raw binary data."""
+    def __init__(self):
+        self._options = []
+        self._numbers = []
+        self._value_list_cache = {}
+        self._encoded_cache = None
+
+    def decode(self, buf, offset=0):
+        """Decode all options in message from raw binary data.
+
+        Returns the offset at which the payload starts (just past the
+        payload marker), or len(buf) if there is no payload.
+        """
+        mv = memoryview(buf)
+        table = _option_table
+        table_size = len(table)
+        if parse_options is not None:
+            numbers, starts, lengths, count, payload_offset = parse_options(buf, offset)
+            for k in range(count):
+                option_number = int(numbers[k])
+                start = int(starts[k])
+                cls = table[option_number] if option_number < table_size else OpaqueOption
+                option = cls(option_number)
+                option.decode(mv[start:start + int(lengths[k])])
+                self.add_option(option)
+            return payload_offset
         option_number = 0
-        while len(rawdata) > 0:
-            if rawdata[0] == 0xFF:
-                return rawdata[1:]
-            dllen = rawdata[0]
+        ext_table = _ext_field_table
+        i = offset
+        end = len(buf)
+        while i < end:
+            dllen = buf[i]
+            if dllen == 0xFF:
+                return i + 1
             delta = (dllen & 0xF0) >> 4
             length = (dllen & 0x0F)
-            rawdata = rawdata[1:]
-            (delta, rawdata) = self.read_extended_field_value(delta, rawdata)
-            (length, rawdata) = self.read_extended_field_value(length, rawdata)
+            i += 1
+            extra, bias = ext_table[delta]
+            if extra == 1:
+                if i >= end:
+                    raise ValueError("Option header is truncated.")
+                delta = buf[i] + bias
+                i += 1
+            elif extra == 2:
+                if i + 1 >= end:
+                    raise ValueError("Option header is truncated.")
+                delta = ((buf[i] << 8) | buf[i + 1]) + bias
+                i += 2
+            elif extra is None:
+                raise ValueError("Value out of range.")
+            extra, bias = ext_table[length]
+            if extra == 1:
+                if i >= end:
+                    raise ValueError("Option header is truncated.")
+                length = buf[i] + bias
+                i += 1
+            elif extra == 2:
+                if i + 1 >= end:
+                    raise ValueError("Option header is truncated.")
+                length = ((buf[i] << 8) | buf[i + 1]) + bias
+                i += 2
+            elif extra is None:
+                raise ValueError("Value out of range.")
+            if i + length > end:
+                raise ValueError("Option value is truncated.")
             option_number += delta
-            option = option_formats.get(option_number, OpaqueOption)(option_number)
-            option.decode(rawdata[:length])
+            cls = table[option_number] if option_number < table_size else OpaqueOption
+            option = cls(option_number)
+            option.decode(mv[i:i + length])
             self.add_option(option)
-            rawdata = rawdata[length:]
-        return b''
+            i += length
+        return end
 
     def encode(self):
-        """Encode all options in option header into string of bytes."""
-        data = []
+        """Encode all options in option header into string of bytes.
+
+        The encoded form is cached until an option is added or deleted,
+        so re-encoding for a retransmission is free. Mutations must go
+        through add_option/delete_option (the convenience setters do);
+        changing an option's value in place will not invalidate the
+        cache.
+        """
+        if self._encoded_cache is not None:
+            return self._encoded_cache
+        data = bytearray()
         current_opt_num = 0
-        option_list = self.option_list()
-        for option in option_list:
-            delta, extended_delta = self.write_extended_field_value(int(option.number - current_opt_num))
-            length, extended_length = self.write_extended_field_value(int(option.length))
-            data.append(bytes([((delta & 0x0F) << 4) + (length & 0x0F)]))
-            data.append(extended_delta)
-            data.append(extended_length)
-            data.append(option.encode())
+        for option in self._options:
+            delta = option.number - current_opt_num
+            if delta < 13:
+                extended_delta = b''
+            elif delta < 269:
+                extended_delta = bytes((delta - 13,))
+                delta = 13
+            elif delta < 65804:
+                delta -= 269
+                extended_delta = bytes((delta >> 8, delta & 0xFF))
+                delta = 14
+            else:
+                raise ValueError("Value out of range.")
+            length = option.length
+            if length < 13:
+                extended_length = b''
+            elif length < 269:
+                extended_length = bytes((length - 13,))
+                length = 13
+            elif length < 65804:
+                length -= 269
+                extended_length = bytes((length >> 8, length & 0xFF))
+                length = 14
+            else:
+                raise ValueError("Value out of range.")
+            data.append((delta << 4) + length)
+            data.extend(extended_delta)
+            data.extend(extended_length)
+            data.extend(option.encode())
             current_opt_num = option.number
-        return (b''.join(data))
+        self._encoded_cache = bytes(data)
+        return self._encoded_cache
+
+    @staticmethod
+    def compile_encoder(option_numbers):
+        """Build a specialized encoder for a fixed set of option numbers.
+
+        Handlers usually emit the same options on every response (e.g.
+        Content-Format plus ETag), so the generic encode loop can be
+        unrolled once at handler-registration time. The returned
+        callable takes an Options instance holding exactly the given
+        options and returns the encoded bytes; the option deltas are
+        folded into the generated code as constants. Compiled encoders
+        are cached per number tuple.
+        """
+        numbers = tuple(sorted(option_numbers))
+        encoder = _compiled_encoders.get(numbers)
+        if encoder is not None:
+            return encoder
+        lines = ["def _compiled_encode(options):",
+                 "    opts = options._options",
+                 "    buf = bytearray()",
+                 "    append = buf.append",
+                 "    extend = buf.extend"]
+        current_opt_num = 0
+        for index, number in enumerate(numbers):
+            delta = number - current_opt_num
+            if delta < 13:
+                delta_code = delta << 4
+                extended_delta = b''
+            elif delta < 269:
+                delta_code = 13 << 4
+                extended_delta = bytes((delta - 13,))
+            elif delta < 65804:
+                delta_code = 14 << 4
+                extended_delta = bytes(((delta - 269) >> 8, (delta - 269) & 0xFF))
+            else:
+                raise ValueError("Value out of range.")
+            ext = "    extend(%r)" % (extended_delta,) if extended_delta else None
+            lines.append("    opt = opts[%d]" % index)
+            lines.append("    length = opt.length")
+            lines.append("    if length < 13:")
+            lines.append("        append(%d | length)" % delta_code)
+            if ext:
+                lines.append("    " + ext)
+            lines.append("    elif length < 269:")
+            lines.append("        append(%d)" % (delta_code | 13))
+            if ext:
+                lines.append("    " + ext)
+            lines.append("        append(length - 13)")
+            lines.append("    elif length < 65804:")
+            lines.append("        append(%d)" % (delta_code | 14))
+            if ext:
+                lines.append("    " + ext)
+            lines.append("        extend(((length - 269) >> 8, (length - 269) & 0xFF))")
+            lines.append("    else:")
+            lines.append("        raise ValueError(\"Value out of range.\")")
+            lines.append("    extend(opt.encode())")
+            current_opt_num = number
+        lines.append("    return bytes(buf)")
+        namespace = {}
+        exec("\n".join(lines), namespace)
+        encoder = namespace['_compiled_encode']
+        _compiled_encoders[numbers] = encoder
+        return encoder
 
     def add_option(self, option):
         """Add option into option header."""
-        self._options.setdefault(option.number, []).append(option)
+        number = option.number
+        self._value_list_cache.pop(number, None)
+        self._encoded_cache = None
+        index = bisect_right(self._numbers, number)
+        self._numbers.insert(index, number)
+        self._options.insert(index, option)
 
     def delete_option(self, number):
         """Delete option from option header."""
-        if number in self._options:
-            self._options.pop(number)
+        self._value_list_cache.pop(number, None)
+        self._encoded_cache = None
+        low = bisect_left(self._numbers, number)
+        high = bisect_right(self._numbers, number, lo=low)
+        del self._numbers[low:high]
+        del self._options[low:high]
 
     def get_option(self, number):
         """Get option with specified number."""
-        return self._options.get(number)
+        low = bisect_left(self._numbers, number)
+        high = bisect_right(self._numbers, number, lo=low)
+        if high == low:
+            return None
+        return self._options[low:high]
 
     def option_list(self):
-        return chain.from_iterable(sorted(self._options.values(), key=lambda x: x[0].number))
+        return iter(self._options)
+
+    def reset(self):
+        """Clear all options so the instance can be reused."""
+        del self._options[:]
+        del self._numbers[:]
+        self._value_list_cache.clear()
+        self._encoded_cache = None
+
+    def _get_value_list(self, number):
+        """Get values of all options with specified number as a list.
+
+        The list is cached until an option with that number is added
+        or deleted, so repeated reads of e.g. uri_path do not rebuild
+        it from the options. A copy is returned so callers that mutate
+        the result (e.g. routing popping path segments) cannot corrupt
+        the cache.
+        """
+        values = self._value_list_cache.get(number)
+        if values is None:
+            options = self.get_option(number)
+            values = [] if options is None else [option.value for option in options]
+            self._value_list_cache[number] = values
+        return list(values)
 
     def get_uri_path_as_string(self):
         return '/' + '/'.join(self.uri_path)
@@ -80,12 +275,7 @@ class Options(object):
 
     def _get_uri_path(self):
         """Convenience getter: Uri-Path option"""
-        segment_list = []
-        uri_path = self.get_option(number=URI_PATH)
-        if uri_path is not None:
-            for segment in uri_path:
-                segment_list.append(segment.value)
-        return segment_list
+        return self._get_value_list(number=URI_PATH)
 
     uri_path = property(_get_uri_path, _set_uri_path)
 
@@ -99,12 +289,7 @@ class Options(object):
 
     def _get_uri_query(self):
         """Convenience getter: Uri-Query option"""
-        segment_list = []
-        uri_query = self.get_option(number=URI_QUERY)
-        if uri_query is not None:
-            for segment in uri_query:
-                segment_list.append(segment.value)
-        return segment_list
+        return self._get_value_list(number=URI_QUERY)
 
     uri_query = property(_get_uri_query, _set_uri_query)
 
@@ -175,8 +360,7 @@ class Options(object):
             self.add_option(OpaqueOption(number=ETAG, value=tag))
 
     def _get_etags(self):
-        etag = self.get_option(number=ETAG)
-        return [] if etag is None else [tag.value for tag in etag]
+        return self._get_value_list(number=ETAG)
 
     etags = property(_get_etags, _set_etags, None, "Access to a list of ETags on the message (as used in requests)")
 
@@ -218,12 +402,7 @@ class Options(object):
 
     def _get_location_path(self):
         """Convenience getter: Location-Path option"""
-        segment_list = []
-        location_path = self.get_option(number=LOCATION_PATH)
-        if location_path is not None:
-            for segment in location_path:
-                segment_list.append(segment.value)
-        return segment_list
+        return self._get_value_list(number=LOCATION_PATH)
 
     location_path = property(_get_location_path, _set_location_path)
 
@@ -256,18 +435,18 @@ class Options(object):
             raise ValueError("Value out of range.")
 
 
-class Option(ABC):
-    @abstractmethod
+class Option(object):
+    """Base class of the option types. Subclasses implement encode,
+       decode and _length."""
+
     def encode(self):
-        pass
+        raise NotImplementedError
 
-    @abstractmethod
-    def decode(self):
-        pass
+    def decode(self, rawdata):
+        raise NotImplementedError
 
-    @abstractmethod
     def _length(self):
-        pass
+        raise NotImplementedError
 
 
 class OpaqueOption(Option):
@@ -278,15 +457,33 @@ class OpaqueOption(Option):
         self.value = value
         self.number = number
 
+    def reset(self, number, value=""):
+        """Re-initialize the option in place so the instance can be reused."""
+        self.value = value
+        self.number = number
+        return self
+
+    def _get_value(self):
+        if self._raw is not None:
+            self._value = bytes(self._raw)
+            self._raw = None
+        return self._value
+
+    def _set_value(self, value):
+        self._value = value
+        self._raw = None
+
+    value = property(_get_value, _set_value)
+
     def encode(self):
-        rawdata = self.value
-        return rawdata
+        return self.value
 
     def decode(self, rawdata):
-        self.value = rawdata  # if rawdata is not None else ""
+        self._value = None
+        self._raw = rawdata
 
     def _length(self):
-        return len(self.value)
+        return len(self._value if self._raw is None else self._raw)
     length = property(_length)
 
 
@@ -297,15 +494,33 @@ class StringOption(Option):
         self.value = value
         self.number = number
 
+    def reset(self, number, value=""):
+        """Re-initialize the option in place so the instance can be reused."""
+        self.value = value
+        self.number = number
+        return self
+
+    def _get_value(self):
+        if self._raw is not None:
+            self._value = bytes(self._raw)
+            self._raw = None
+        return self._value
+
+    def _set_value(self, value):
+        self._value = value
+        self._raw = None
+
+    value = property(_get_value, _set_value)
+
     def encode(self):
-        rawdata = self.value
-        return rawdata
+        return self.value
 
     def decode(self, rawdata):
-        self.value = rawdata  # if rawdata is not None else ""
+        self._value = None
+        self._raw = rawdata
 
     def _length(self):
-        return len(self.value)
+        return len(self._value if self._raw is None else self._raw)
     length = property(_length)
 
 
@@ -316,48 +531,103 @@ class UintOption(Option):
         self.value = value
         self.number = number
 
+    def reset(self, number, value=0):
+        """Re-initialize the option in place so the instance can be reused."""
+        self.value = value
+        self.number = number
+        return self
+
+    def _get_value(self):
+        return self._value
+
+    def _set_value(self, value):
+        self._value = value
+        self._encoded = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+
+    value = property(_get_value, _set_value)
+
     def encode(self):
-        rawdata = struct.pack("!L", self.value)  # For Python >3.1 replace with int.to_bytes()
-        return rawdata.lstrip(bytes([0]))
+        return self._encoded
 
-    def decode(self, rawdata):  # For Python >3.1 replace with int.from_bytes()
-        value = 0
-        for byte in rawdata:
-            value = (value * 256) + byte
-        self.value = value
+    def decode(self, rawdata):
+        if isinstance(rawdata, str):
+            rawdata = rawdata.encode('latin-1')
+        self.value = int.from_bytes(rawdata, 'big')
         return self
 
     def _length(self):
-        if self.value > 0:
-            return (self.value.bit_length() - 1) // 8 + 1
-        else:
-            return 0
+        return len(self._encoded)
     length = property(_length)
 
 
+class BlockwiseTuple(object):
+    """Lightweight num/m/szx triple describing a block option value."""
+    __slots__ = ('num', 'm', 'szx')
+
+    def __init__(self, num, m, szx):
+        self.num = num
+        self.m = m
+        self.szx = szx
+
+    def __iter__(self):
+        yield self.num
+        yield self.m
+        yield self.szx
+
+    def __getitem__(self, index):
+        return (self.num, self.m, self.szx)[index]
+
+    def __hash__(self):
+        return hash((self.num, self.m, self.szx))
+
+    def __eq__(self, other):
+        if isinstance(other, BlockwiseTuple):
+            other = (other.num, other.m, other.szx)
+        if isinstance(other, tuple):
+            return (self.num, self.m, self.szx) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return 'BlockwiseTuple(num=%r, m=%r, szx=%r)' % (self.num, self.m, self.szx)
+
+
 class BlockOption(Option):
     """Block CoAP option - special option used only for Block1 and Block2 options.
        Currently it is the only type of CoAP options that has
        internal structure."""
-    BlockwiseTuple = collections.namedtuple('BlockwiseTuple', ['num', 'm', 'szx'])
+    BlockwiseTuple = BlockwiseTuple
 
     def __init__(self, number, value=(0, None, 0)):
-        self.value = self.BlockwiseTuple._make(value)
+        self.value = value
         self.number = number
 
+    def reset(self, number, value=(0, None, 0)):
+        """Re-initialize the option in place so the instance can be reused."""
+        self.value = value
+        self.number = number
+        return self
+
+    def _get_value(self):
+        return self._value
+
+    def _set_value(self, value):
+        if not isinstance(value, BlockwiseTuple):
+            value = BlockwiseTuple(*value)
+        self._value = value
+        as_integer = (value.num << 4) | ((0x08 if value.m else 0) | value.szx)
+        self._encoded = as_integer.to_bytes((as_integer.bit_length() + 7) // 8, 'big')
+
+    value = property(_get_value, _set_value)
+
     def encode(self):
-        as_integer = (self.value[0] << 4) + (self.value[1] * 0x08) + self.value[2]
-        rawdata = struct.pack("!L", as_integer)  # For Python >3.1 replace with int.to_bytes()
-        return rawdata.lstrip(bytes([0]))
+        return self._encoded
 
     def decode(self, rawdata):
-        as_integer = 0
-        for byte in rawdata:
-            as_integer = (as_integer * 256) + byte
-        self.value = self.BlockwiseTuple(num=(as_integer >> 4), m=bool(as_integer & 0x08), szx=(as_integer & 0x07))
+        as_integer = int.from_bytes(rawdata, 'big')
+        self.value = (as_integer >> 4, bool(as_integer & 0x08), as_integer & 0x07)
 
     def _length(self):
-        return ((self.value[0].bit_length() + 3) / 8 + 1)
+        return len(self._encoded)
     length = property(_length)
 
 option_formats = {3:  StringOption,     # If-Match
@@ -377,3 +647,37 @@ option_formats = {3:  StringOption,     # If-Match
                   39: StringOption,     # Proxy-Scheme
                   60: UintOption}       # Size1
 """Dictionary used to assign option type to option numbers."""
+
+_options_pool = collections.deque()
+_OPTIONS_POOL_SIZE = 32
+
+def acquire_options():
+    """Get an Options instance, reusing a pooled one when available.
+
+    The caller owns the instance until it is handed back with
+    release_options. Pooling is opt-in: applications that parse and
+    discard many messages can recycle the per-message Options container
+    instead of allocating a fresh one each time.
+    """
+    try:
+        return _options_pool.pop()
+    except IndexError:
+        return Options()
+
+def release_options(options):
+    """Return an Options instance to the pool for later reuse.
+
+    The instance is cleared before being pooled. The caller must drop
+    all references to it and to the option objects it held; values
+    read from the options remain valid.
+    """
+    if len(_options_pool) < _OPTIONS_POOL_SIZE:
+        options.reset()
+        _options_pool.append(options)
+
+_option_table = [OpaqueOption] * (max(option_formats) + 1)
+for _number, _format in option_formats.items():
+    _option_table[_number] = _format
+del _number, _format
+"""Array variant of option_formats indexed directly by option number,
+with OpaqueOption filled in for unassigned numbers."""
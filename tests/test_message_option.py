@@ -130,6 +130,30 @@ class TestUintOption(unittest.TestCase):
             self.assertEqual(option.UintOption(0,argument)._length(), result,'wrong length for option value : '+ str(argument))
 
 
+class TestOptionsPool(unittest.TestCase):
+
+    def test_acquire_use_release_reacquire(self):
+        opt = option.acquire_options()
+        opt.uri_path = (b"core", )
+        option.release_options(opt)
+        reacquired = option.acquire_options()
+        self.assertIs(reacquired, opt, 'released instance was not reused')
+        self.assertEqual(len(reacquired._options), 0, 'reacquired instance still holds options')
+        self.assertEqual(reacquired.uri_path, [], 'reacquired instance still reports a uri_path')
+        self.assertEqual(reacquired.encode(), b'', 'reacquired instance encodes stale options')
+
+    def test_option_reset(self):
+        uint = option.UintOption(constants.ACCEPT, 0).reset(constants.CONTENT_FORMAT, 40)
+        self.assertEqual((uint.number, uint.value, uint.encode()), (constants.CONTENT_FORMAT, 40, bytes([40])),
+                         'wrong UintOption state after reset')
+        opaque = option.OpaqueOption(constants.ETAG, b"abcd").reset(constants.ETAG, b"efgh")
+        self.assertEqual(opaque.value, b"efgh", 'wrong OpaqueOption value after reset')
+        string = option.StringOption(constants.URI_PATH, b"core").reset(constants.URI_PATH, b"other")
+        self.assertEqual(string.value, b"other", 'wrong StringOption value after reset')
+        block = option.BlockOption(constants.BLOCK1, (1, True, 2)).reset(constants.BLOCK1, (3, False, 1))
+        self.assertEqual(block.value, (3, False, 1), 'wrong BlockOption value after reset')
+
+
 class TestOptions(unittest.TestCase):
 
     def test_setUriPath(self):
@@ -147,5 +171,47 @@ class TestOptions(unittest.TestCase):
         opt3 = option.Options()
         self.assertRaises(ValueError, setattr, opt3, "uri_path", "core")
 
+    def test_blockwise_tuple_behaves_like_a_tuple(self):
+        value = option.BlockOption(constants.BLOCK1, (3, True, 2)).value
+        self.assertEqual(value, (3, True, 2), 'wrong tuple equality for block value')
+        self.assertEqual((value[0], value[1], value[2]), (3, True, 2), 'wrong indexing for block value')
+        self.assertEqual(hash(value), hash((3, True, 2)), 'wrong hash for block value')
+
+    def test_mutating_uri_path_does_not_corrupt_cache(self):
+        opt = option.Options()
+        opt.uri_path = (b"a", b"b")
+        opt.uri_path.pop(0)
+        self.assertEqual(opt.uri_path, [b"a", b"b"], 'mutating the returned uri_path list affected later reads')
+
+    def test_encode_cache(self):
+        opt = option.Options()
+        opt.uri_path = (b"core", )
+        encoded = opt.encode()
+        self.assertIs(opt.encode(), encoded, 'repeated encode did not reuse the cached bytes')
+        opt.content_format = 40
+        self.assertNotEqual(opt.encode(), encoded, 'encode cache not invalidated after option change')
+
+    def test_compile_encoder(self):
+        opt = option.Options()
+        opt.uri_path = (b"core", b".well-known")
+        opt.content_format = 40
+        encoder = option.Options.compile_encoder((constants.URI_PATH, constants.URI_PATH, constants.CONTENT_FORMAT))
+        self.assertEqual(encoder(opt), opt.encode(), 'compiled encoder output differs from generic encode')
+        self.assertIs(encoder, option.Options.compile_encoder((constants.URI_PATH, constants.URI_PATH, constants.CONTENT_FORMAT)),
+                      'compiled encoder is not cached')
+
+    def test_decode_truncated_option(self):
+        opt = option.Options()
+        # Header declares a 4-byte Uri-Path value but only 2 bytes follow.
+        self.assertRaises(ValueError, opt.decode, bytes([0xB4]) + b"ab")
+
+    def test_decode_truncated_extended_field(self):
+        # Extended delta nibble with no extension byte behind it.
+        self.assertRaises(ValueError, option.Options().decode, bytes([0xD1]))
+        # Two-byte extended delta cut off after the first extension byte.
+        self.assertRaises(ValueError, option.Options().decode, bytes([0xE1, 0x00]))
+        # Extended length nibble with no extension byte behind it.
+        self.assertRaises(ValueError, option.Options().decode, bytes([0x1D]))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from piccata import _option_jit
+
+
+def parse(rawdata, offset=0):
+    """Run the scanner over rawdata with freshly preallocated output arrays."""
+    size = max(len(rawdata) - offset, 1)
+    numbers = [0] * size
+    starts = [0] * size
+    lengths = [0] * size
+    count, payload_offset = _option_jit._parse_option_headers(
+        rawdata, offset, len(rawdata), numbers, starts, lengths)
+    return numbers[:count], starts[:count], lengths[:count], payload_offset
+
+
+class TestParseOptionHeaders(unittest.TestCase):
+
+    def test_parse_single_option(self):
+        rawdata = bytes([0xB4]) + b"test" + bytes([0xFF]) + b"payload"
+        numbers, starts, lengths, payload_offset = parse(rawdata)
+        self.assertEqual(numbers, [11], 'wrong option number for single Uri-Path option')
+        self.assertEqual(starts, [1], 'wrong value start for single Uri-Path option')
+        self.assertEqual(lengths, [4], 'wrong value length for single Uri-Path option')
+        self.assertEqual(rawdata[payload_offset:], b"payload", 'wrong payload offset')
+
+    def test_parse_extended_delta(self):
+        # Delta 60 (Size1) is encoded as nibble 13 plus one extension byte.
+        rawdata = bytes([0xD1, 47, 5])
+        numbers, starts, lengths, payload_offset = parse(rawdata)
+        self.assertEqual(numbers, [60], 'wrong option number for extended delta')
+        self.assertEqual(lengths, [1], 'wrong value length for extended delta')
+        self.assertEqual(payload_offset, len(rawdata), 'wrong payload offset without payload marker')
+
+    def test_parse_multiple_options(self):
+        rawdata = bytes([0xB1]) + b"a" + bytes([0x01]) + b"b"
+        numbers, starts, lengths, payload_offset = parse(rawdata)
+        self.assertEqual(numbers, [11, 11], 'wrong option numbers for repeated Uri-Path options')
+        self.assertEqual(starts, [1, 3], 'wrong value starts for repeated Uri-Path options')
+
+    def test_parse_truncated_value(self):
+        # Header declares a 4-byte value but only 2 bytes follow.
+        self.assertRaises(ValueError, parse, bytes([0xB4]) + b"ab")
+
+    def test_parse_truncated_extended_field(self):
+        # Extended delta nibble with no extension byte behind it.
+        self.assertRaises(ValueError, parse, bytes([0xD1]))
+        # Two-byte extended delta cut off after the first extension byte.
+        self.assertRaises(ValueError, parse, bytes([0xE1, 0x00]))
+
+    def test_parse_reserved_nibble(self):
+        self.assertRaises(ValueError, parse, bytes([0xF1]) + b"a")
+
+
+if __name__ == "__main__":
+    unittest.main()